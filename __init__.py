@@ -1,7 +1,14 @@
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Any
-
-from wrpy import WordReference, get_available_dicts
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
 
 from albert import *
 
@@ -15,14 +22,96 @@ md_authors = ["@tomsquest"]
 md_lib_dependencies = ["wrpy"]
 
 plugin_icon = Path(__file__).parent / "wordreference.svg"
+plugin_icon_urls = [f"file:{plugin_icon}"]
+
+cache_max_entries = 512
+cache_ttl_seconds = 24 * 60 * 60
+debounce_seconds = 0.2
+
+# "[4-letter language pair] [text to translate]", e.g. "enfr hello"
+query_re = re.compile(r"^([A-Za-z]{4})\s+(\S.*)$")
+
+
+class ResultRow(NamedTuple):
+    """One formatted translation row, ready to turn into a StandardItem."""
+
+    id: str
+    display_text: str
+    subtext: str
+    meaning: str
+
+
+class CachedTranslation(NamedTuple):
+    """Formatted rows plus the result metadata needed to render them."""
+
+    url: str
+    from_lang: str
+    to_lang: str
+    rows: List[ResultRow]
 
 
 class Plugin(PluginInstance, TriggerQueryHandler):
     def __init__(self) -> None:
         PluginInstance.__init__(self)
         TriggerQueryHandler.__init__(self)
+
+        # Imported here instead of at module level so Albert's plugin scan
+        # doesn't pay for wrpy's dependency tree (requests, bs4, ...)
+        from wrpy import WordReference, get_available_dicts
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # One pooled keep-alive session for all translations saves a TCP/TLS
+        # handshake per request. wrpy issues its calls through a module-level
+        # `requests`, and a Session is call-compatible, so swap it in there.
+        session = requests.Session()
+        session.headers["Connection"] = "keep-alive"
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self.http_session = session
+
+        wr_module = sys.modules[WordReference.__module__]
+        if hasattr(wr_module, "requests"):
+            wr_module.requests = session
+
+        self.wr_class = WordReference
         self.available_dicts: Dict[str, Dict[str, str]] = get_available_dicts()
-        self.wr_instances: Dict[str, WordReference] = {}
+        self.dict_codes = frozenset(self.available_dicts)
+        self.wr_instances: Dict[str, Any] = {}
+        self.translation_cache: OrderedDict[Tuple[str, str], CachedTranslation] = (
+            OrderedDict()
+        )
+
+        cache_dir = self.dataLocation()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_db = sqlite3.connect(
+            cache_dir / "wr_cache.sqlite", check_same_thread=False
+        )
+        self.cache_db.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "lang_pair TEXT, text TEXT, json BLOB, ts INTEGER, "
+            "PRIMARY KEY (lang_pair, text))"
+        )
+        self.cache_db.commit()
+        self.cache_db_lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=4)
+
+        # These items never change, so build them once instead of on every query
+        how_many_examples = 8
+        self.example_pairs: List[Tuple[str, Dict[str, str]]] = [
+            (code, details)
+            for code, details in self.available_dicts.items()
+            if code not in {"esca", "ruen"}
+        ][:how_many_examples]
+        self.items_trigger = self.defaultTrigger()
+        self.usage_items: List[StandardItem] = self._build_usage_items(
+            self.items_trigger
+        )
+        self.pair_hint_items: List[StandardItem] = self._build_pair_hint_items(
+            self.items_trigger
+        )
 
     def supportsFuzzyMatching(self) -> bool:
         return False
@@ -34,38 +123,33 @@ class Plugin(PluginInstance, TriggerQueryHandler):
         return "w "
 
     def handleTriggerQuery(self, query: Query) -> None:
-        query_str = query.string.strip()
-        if not query_str:
-            self._show_usage(query)
-            return
-
-        parts = query_str.split(maxsplit=1)
-        if len(parts) < 2 or len(parts[0]) != 4:
+        match = query_re.match(query.string.strip())
+        if match is None:
             self._show_usage(query)
             return
 
-        lang_pair, text_to_translate = parts[0].lower(), parts[1]
-        if lang_pair not in self.available_dicts:
+        lang_pair, text_to_translate = match.group(1).lower(), match.group(2)
+        if lang_pair not in self.dict_codes:
             self._show_invalid_language_pair(query, lang_pair)
             return
 
         self._translate(query, lang_pair, text_to_translate)
 
-    def _show_usage(self, query: Query) -> None:
-        query.add(
+    def _build_usage_items(self, trigger: str) -> List[StandardItem]:
+        items = [
             StandardItem(
                 id="translator_usage",
                 text="WordReference Translation",
                 subtext="Format: [language_pair] [word] (e.g., 'enfr hello')",
-                iconUrls=[f"file:{plugin_icon}"],
-                inputActionText=f"{query.trigger}enfr ",
+                iconUrls=plugin_icon_urls,
+                inputActionText=f"{trigger}enfr ",
                 actions=[
                     Action(
-                        "copy", "Copy format", lambda: setClipboardText("enfr hello")
+                        "copy", "Copy format", partial(setClipboardText, "enfr hello")
                     )
                 ],
             )
-        )
+        ]
 
         examples = [
             ("enfr hello", "English to French"),
@@ -75,148 +159,269 @@ class Plugin(PluginInstance, TriggerQueryHandler):
         ]
 
         for i, (example, desc) in enumerate(examples):
-            query.add(
+            items.append(
                 StandardItem(
                     id=f"translator_example_{i}",
                     text=f"Example: {example}",
                     subtext=desc,
-                    iconUrls=[f"file:{plugin_icon}"],
-                    inputActionText=f"{query.trigger}{example}",
+                    iconUrls=plugin_icon_urls,
+                    inputActionText=f"{trigger}{example}",
                     actions=[
                         Action(
                             "use",
                             "Use this example",
-                            lambda ex=example: setClipboardText(f"{query.trigger}{ex}"),
+                            partial(setClipboardText, f"{trigger}{example}"),
                         )
                     ],
                 )
             )
 
-    def _show_invalid_language_pair(self, query: Query, lang_pair: str) -> None:
-        query.add(
-            StandardItem(
-                id="translator_invalid_pair",
-                text=f"Invalid language pair: {lang_pair}",
-                subtext="Please use one of the supported language pairs",
-                iconUrls=[f"file:{plugin_icon}"],
-            )
-        )
+        return items
 
-        how_many_examples = 8
-        for code, details in list(self.available_dicts.items())[:how_many_examples]:
-            if code in ["esca", "ruen"]:
-                continue
+    def _build_pair_hint_items(self, trigger: str) -> List[StandardItem]:
+        items = []
 
-            query.add(
+        for code, details in self.example_pairs:
+            items.append(
                 StandardItem(
                     id=f"translator_pair_{code}",
                     text=f"{code}: {details['from']} to {details['to']}",
                     subtext=f"Language pair for translating from {details['from']} to {details['to']}",
-                    iconUrls=[f"file:{plugin_icon}"],
-                    inputActionText=f"{query.trigger}{code} ",
+                    iconUrls=plugin_icon_urls,
+                    inputActionText=f"{trigger}{code} ",
                     actions=[
                         Action(
                             "use",
                             "Use this language pair",
-                            lambda c=code: setClipboardText(f"{query.trigger}{c} "),
+                            partial(setClipboardText, f"{trigger}{code} "),
                         )
                     ],
                 )
             )
 
+        return items
+
+    def _ensure_items_for_trigger(self, trigger: str) -> None:
+        # The cached items bake the trigger into their input action texts;
+        # rebuild them if the user has remapped it since they were built
+        if trigger != self.items_trigger:
+            self.items_trigger = trigger
+            self.usage_items = self._build_usage_items(trigger)
+            self.pair_hint_items = self._build_pair_hint_items(trigger)
+
+    def _show_usage(self, query: Query) -> None:
+        self._ensure_items_for_trigger(query.trigger)
+        # Query.add accepts a list; one call avoids a C-boundary hop per item
+        query.add(self.usage_items)
+
+    def _show_invalid_language_pair(self, query: Query, lang_pair: str) -> None:
+        self._ensure_items_for_trigger(query.trigger)
+        query.add(
+            [
+                StandardItem(
+                    id="translator_invalid_pair",
+                    text=f"Invalid language pair: {lang_pair}",
+                    subtext="Please use one of the supported language pairs",
+                    iconUrls=plugin_icon_urls,
+                ),
+                *self.pair_hint_items,
+            ]
+        )
+
+    def _load_result_from_disk(self, lang_pair: str, text_lower: str) -> Any:
+        with self.cache_db_lock:
+            row = self.cache_db.execute(
+                "SELECT json, ts FROM translations WHERE lang_pair = ? AND text = ?",
+                (lang_pair, text_lower),
+            ).fetchone()
+        if row is None or time.time() - row[1] > cache_ttl_seconds:
+            return None
+        return json.loads(row[0])
+
+    def _store_result_to_disk(
+        self, lang_pair: str, text_lower: str, result: Dict[str, Any]
+    ) -> None:
+        with self.cache_db_lock:
+            self.cache_db.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                (lang_pair, text_lower, json.dumps(result), int(time.time())),
+            )
+            self.cache_db.commit()
+
+    def _fetch_translation(
+        self, query: Query, lang_pair: str, text: str
+    ) -> Optional[Dict[str, Any]]:
+        # Debounce: wait for the user to stop typing before hitting the
+        # network; memory and disk cache hits never reach this point
+        time.sleep(debounce_seconds)
+        if not query.isValid:
+            return None
+
+        if lang_pair not in self.wr_instances:
+            self.wr_instances[lang_pair] = self.wr_class(lang_pair)
+
+        # Run the blocking HTTP call on the pool so we can keep polling
+        # query.isValid and abandon the wait as soon as the user types on
+        future = self.pool.submit(self.wr_instances[lang_pair].translate, text)
+        while True:
+            try:
+                return future.result(timeout=0.05)
+            except FutureTimeoutError:
+                if not query.isValid:
+                    future.cancel()
+                    return None
+
+    def _cached_translate(
+        self, query: Query, lang_pair: str, text: str
+    ) -> Optional[CachedTranslation]:
+        cache_key = (lang_pair, text.lower())
+        if cache_key in self.translation_cache:
+            self.translation_cache.move_to_end(cache_key)
+            return self.translation_cache[cache_key]
+
+        result = self._load_result_from_disk(*cache_key)
+        if result is None:
+            result = self._fetch_translation(query, lang_pair, text)
+            if result is None:
+                return None
+            self._store_result_to_disk(*cache_key, result)
+
+        cached = CachedTranslation(
+            url=result.get("url", ""),
+            from_lang=result.get("from_lang", ""),
+            to_lang=result.get("to_lang", ""),
+            rows=self._build_result_rows(result, text),
+        )
+        self.translation_cache[cache_key] = cached
+        if len(self.translation_cache) > cache_max_entries:
+            self.translation_cache.popitem(last=False)
+        return cached
+
+    def _build_result_rows(self, result: Dict[str, Any], text: str) -> List[ResultRow]:
+        rows: List[ResultRow] = []
+        if not result or not result.get("translations"):
+            return rows
+
+        text_lower = text.lower()
+        for section_idx, section in enumerate(result["translations"]):
+            section_title = section.get("title", f"Section {section_idx + 1}")
+
+            for entry_idx, entry in enumerate(section.get("entries", [])):
+                if (
+                    section_idx == 0
+                    and entry_idx == 0
+                    and entry.get("from_word", {}).get("source", "").lower()
+                    == text_lower
+                ):
+                    continue
+
+                context = entry.get("context", "")
+                from_word: Dict[str, str] = entry.get("from_word", {})
+                source = from_word.get("source", text)
+                from_grammar = from_word.get("grammar", "")
+                from_example = entry.get("from_example", "")
+
+                to_words: List[Dict[str, str]] = entry.get("to_word", [])
+                for to_idx, to_word in enumerate(to_words):
+                    meaning = to_word.get("meaning", "")
+                    notes = to_word.get("notes", "")
+                    grammar = to_word.get("grammar", "")
+
+                    source_with_grammar = " ".join(
+                        p for p in (source, from_grammar) if p
+                    )
+                    target_with_grammar = " ".join(
+                        p
+                        for p in (meaning, grammar, f"({notes})" if notes else "")
+                        if p
+                    )
+
+                    display_text = " → ".join(
+                        (source_with_grammar, target_with_grammar)
+                    )
+
+                    subtext_parts = [context] if context else []
+                    example_parts = [from_example] if from_example else []
+                    to_examples: List[str] = entry.get("to_example", [])
+                    if to_examples and to_idx < len(to_examples):
+                        example_parts.append(to_examples[to_idx])
+
+                    if example_parts:
+                        subtext_parts.append(" ⟹ ".join(example_parts))
+
+                    subtext = (
+                        "\n".join(subtext_parts) if subtext_parts else section_title
+                    )
+
+                    rows.append(
+                        ResultRow(
+                            id=f"translator_result_{section_idx}_{entry_idx}_{to_idx}",
+                            display_text=display_text,
+                            subtext=subtext,
+                            meaning=meaning,
+                        )
+                    )
+
+        return rows
+
     def _translate(self, query: Query, lang_pair: str, text: str) -> None:
+        if not query.isValid:
+            return
+
         try:
-            if lang_pair not in self.wr_instances:
-                self.wr_instances[lang_pair] = WordReference(lang_pair)
+            cached = self._cached_translate(query, lang_pair, text)
+            if cached is None:
+                # Abandoned mid-fetch because the query was invalidated
+                return
 
-            result = self.wr_instances[lang_pair].translate(text)
-            if not result or "translations" not in result or not result["translations"]:
+            if not cached.rows:
                 query.add(
                     StandardItem(
                         id="translator_no_results",
                         text="No translation results found",
-                        subtext=f"Could not translate '{text}' from {result.get('from_lang', '')} to {result.get('to_lang', '')}",
-                        iconUrls=[f"file:{plugin_icon}"],
+                        subtext=f"Could not translate '{text}' from {cached.from_lang} to {cached.to_lang}",
+                        iconUrls=plugin_icon_urls,
                         actions=[
                             Action(
-                                "retry", "Try again", lambda t=text: setClipboardText(t)
+                                "retry", "Try again", partial(setClipboardText, text)
                             )
                         ],
                     )
                 )
                 return
 
-            url = result.get("url", "")
-            for section_idx, section in enumerate(result["translations"]):
-                section_title = section.get("title", f"Section {section_idx + 1}")
-
-                for entry_idx, entry in enumerate(section.get("entries", [])):
-                    if (
-                        section_idx == 0
-                        and entry_idx == 0
-                        and entry.get("from_word", {}).get("source", "").lower()
-                        == text.lower()
-                    ):
-                        continue
-
-                    context = entry.get("context", "")
-                    from_word: Dict[str, str] = entry.get("from_word", {})
-                    source = from_word.get("source", text)
-                    from_grammar = from_word.get("grammar", "")
-                    from_example = entry.get("from_example", "")
-
-                    to_words: List[Dict[str, str]] = entry.get("to_word", [])
-                    for to_idx, to_word in enumerate(to_words):
-                        meaning = to_word.get("meaning", "")
-                        notes = to_word.get("notes", "")
-                        grammar = to_word.get("grammar", "")
-
-                        source_with_grammar = f"{source} {from_grammar}".strip()
-                        target_with_grammar = f"{meaning} {grammar} ({notes})".strip()
-
-                        display_text = f"{source_with_grammar} → {target_with_grammar}"
-
-                        subtext_parts = [context] if context else []
-                        example_parts = [from_example] if from_example else []
-                        to_examples: List[str] = entry.get("to_example", [])
-                        if to_examples and to_idx < len(to_examples):
-                            example_parts.append(to_examples[to_idx])
-
-                        if example_parts:
-                            subtext_parts.append(" ⟹ ".join(example_parts))
-
-                        subtext = (
-                            "\n".join(subtext_parts) if subtext_parts else section_title
-                        )
-
-                        result_id = (
-                            f"translator_result_{section_idx}_{entry_idx}_{to_idx}"
+            result_items: List[StandardItem] = []
+            for row in cached.rows:
+                # The user may have kept typing; don't build items nobody will see
+                if not query.isValid:
+                    return
+
+                result_item = StandardItem(
+                    id=row.id,
+                    text=row.display_text,
+                    subtext=row.subtext,
+                    iconUrls=plugin_icon_urls,
+                    actions=[
+                        Action(
+                            "copy",
+                            "Copy translation",
+                            partial(setClipboardText, row.meaning),
                         )
+                    ],
+                )
 
-                        result_item = StandardItem(
-                            id=result_id,
-                            text=display_text,
-                            subtext=subtext,
-                            iconUrls=[f"file:{plugin_icon}"],
-                            actions=[
-                                Action(
-                                    "copy",
-                                    "Copy translation",
-                                    lambda m=meaning: setClipboardText(m),
-                                )
-                            ],
+                if cached.url:
+                    result_item.actions.append(
+                        Action(
+                            "open",
+                            "Open in browser",
+                            partial(openUrl, cached.url),
                         )
+                    )
 
-                        if url:
-                            result_item.actions.append(
-                                Action(
-                                    "open",
-                                    "Open in browser",
-                                    lambda u=url: openUrl(u),
-                                )
-                            )
+                result_items.append(result_item)
 
-                        query.add(result_item)
+            query.add(result_items)
 
         except Exception as e:
             query.add(
@@ -224,12 +429,12 @@ class Plugin(PluginInstance, TriggerQueryHandler):
                     id="translator_error",
                     text=str(e),
                     subtext="",
-                    iconUrls=[f"file:{plugin_icon}"],
+                    iconUrls=plugin_icon_urls,
                     actions=[
                         Action(
                             "copy",
                             "Copy error",
-                            lambda err=str(e): setClipboardText(err),
+                            partial(setClipboardText, str(e)),
                         )
                     ],
                 )